@@ -0,0 +1,23 @@
+"""
+blend.py - Numba-compiled alpha blending used by overlay.py.
+
+Importing this module raises ImportError when numba is not installed;
+overlay.py then falls back to NumPy or Pillow for blending.
+
+Requirements:
+  pip install numba --break-system-packages
+"""
+
+from numba import njit
+
+
+@njit(fastmath=True, cache=True)
+def alpha_over(bg, fg_rgba):
+    """Blend an RGBA uint8 array over an RGB uint8 array of the same size, in place."""
+    h, w, _ = fg_rgba.shape
+    for y in range(h):
+        for x in range(w):
+            a  = int(fg_rgba[y, x, 3])
+            ia = 255 - a
+            for c in range(3):
+                bg[y, x, c] = (int(fg_rgba[y, x, c]) * a + int(bg[y, x, c]) * ia + 127) // 255
@@ -33,89 +33,324 @@ Usage:
 
 Requirements:
   pip install pillow pilmoji --break-system-packages
+
+  Optional, vectorized overlay blending when pillow-simd isn't installed:
+  pip install numpy --break-system-packages
+
+  Optional, JIT-compiled overlay blending (see blend.py):
+  pip install numba --break-system-packages
+
+  Optional, faster drop-in replacement for pillow (SSE4 / AVX2 kernels):
+  pip uninstall pillow && pip install pillow-simd --break-system-packages
 """
 
 import argparse
 import csv
 import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from itertools import islice
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
+import PIL
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 
 try:
     from pilmoji import Pilmoji
+    from pilmoji.helpers import EMOJI_REGEX
+    from pilmoji.source import Twemoji
     HAS_PILMOJI = True
 except ImportError:
     HAS_PILMOJI = False
 
+EMOJI_CACHE_DIR = Path.home() / ".cache" / "pilmoji"
+
+if HAS_PILMOJI:
+    class CachedTwemoji(Twemoji):
+        """Twemoji source backed by an in-memory and on-disk PNG cache."""
+
+        def __init__(self):
+            super().__init__()
+            self._memory = {}
+
+        def get_emoji(self, emoji, /):
+            if emoji not in self._memory:
+                path = EMOJI_CACHE_DIR / ("-".join(f"{ord(c):x}" for c in emoji) + ".png")
+                if path.exists():
+                    data = path.read_bytes()
+                else:
+                    stream = super().get_emoji(emoji)
+                    if stream is None:
+                        return None
+                    data = stream.getvalue()
+                    tmp  = path.with_suffix(f".{os.getpid()}.tmp")
+                    try:
+                        EMOJI_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                        tmp.write_bytes(data)
+                        os.replace(tmp, path)
+                    except OSError:
+                        # Unwritable cache dir; keep the in-memory copy only
+                        pass
+                self._memory[emoji] = data
+            return BytesIO(self._memory[emoji])
+
+    # One source per process so the emoji cache outlives each per-row Pilmoji
+    EMOJI_SOURCE = CachedTwemoji()
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    from blend import alpha_over
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Pillow-SIMD releases carry a ".postN" version suffix
+PILLOW_SIMD = ".post" in PIL.__version__
+
+PRINTABLE_ASCII = "".join(chr(c) for c in range(32, 127))
+
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff"}
 
+# Per-process caches, filled lazily inside each worker. Decoded bases and
+# canvases live in bounded LRU caches on load_base / load_canvas.
+_font_cache    = {}
+_overlay_cache = {}
+
 
 def is_image_path(value):
     return Path(value).suffix.lower() in IMAGE_EXTENSIONS
 
 
+def has_emoji(label):
+    # Same pattern Pilmoji splits labels on; without a match it draws plain text
+    return EMOJI_REGEX.search(label) is not None
+
+
+# Rows reach each worker grouped by base image (see main), so holding one
+# decoded base and its canvas per worker keeps every group fully cached
+@lru_cache(maxsize=1)
+def load_base(path, max_size=None):
+    base = Image.open(path)
+    if max_size:
+        if base.format == "JPEG":
+            # Let libjpeg downscale in the DCT domain while decoding
+            base.draft("RGB", (max_size, max_size))
+        base.thumbnail((max_size, max_size), Image.LANCZOS)
+    # Decode now so copies and crops never go back to the file
+    base.load()
+    # Keep bases in RGB; only the overlay bounding box is ever blended in RGBA
+    return base if base.mode == "RGB" else base.convert("RGB")
+
+
+@lru_cache(maxsize=1)
+def load_canvas(path, max_size=None):
+    # Reusable working copy of a base; rows must restore what they draw over
+    return load_base(path, max_size).copy()
+
+
+def load_font(font_path, font_size):
+    key = (font_path, font_size)
+    if key not in _font_cache:
+        font = ImageFont.truetype(font_path, font_size)
+        # Best-effort warm-up: touch every printable ASCII glyph once at load.
+        # Pillow keeps no glyph cache between calls, so this is not a cache
+        # (text_size() is what avoids re-measuring repeated labels).
+        ImageDraw.Draw(Image.new("RGB", (1, 1))).textbbox((0, 0), PRINTABLE_ASCII, font=font)
+        _font_cache[key] = font
+    return _font_cache[key]
+
+
+# Anchor -> top-left corner of an object, built once at import
+_POSITIONS = {
+    "top-left":     lambda iw, ih, ow, oh, ox, oy: (ox, oy),
+    "top-right":    lambda iw, ih, ow, oh, ox, oy: (iw - ow - ox, oy),
+    "bottom-left":  lambda iw, ih, ow, oh, ox, oy: (ox, ih - oh - oy),
+    "bottom-right": lambda iw, ih, ow, oh, ox, oy: (iw - ow - ox, ih - oh - oy),
+    "center":       lambda iw, ih, ow, oh, ox, oy: ((iw - ow) // 2, (ih - oh) // 2),
+}
+
+
 def get_xy(anchor, img_w, img_h, obj_w, obj_h, ox, oy):
-    return {
-        "top-left":     (ox, oy),
-        "top-right":    (img_w - obj_w - ox, oy),
-        "bottom-left":  (ox, img_h - obj_h - oy),
-        "bottom-right": (img_w - obj_w - ox, img_h - obj_h - oy),
-        "center":       ((img_w - obj_w) // 2, (img_h - obj_h) // 2),
-    }[anchor]
+    return _POSITIONS[anchor](img_w, img_h, obj_w, obj_h, ox, oy)
 
 
 def measure_text(img, label, font):
-    if HAS_PILMOJI:
-        with Pilmoji(img) as pj:
+    if HAS_PILMOJI and has_emoji(label):
+        with Pilmoji(img, source=EMOJI_SOURCE) as pj:
             s = pj.getsize(label, font)
             return s[0], s[1]
     bbox = ImageDraw.Draw(img).textbbox((0, 0), label, font=font)
     return bbox[2] - bbox[0], bbox[3] - bbox[1]
 
 
-def draw_text(img, label, font, color, position, ox, oy):
-    text_w, text_h = measure_text(img, label, font)
+@lru_cache(maxsize=512)
+def text_size(label, font_path, font_size):
+    return measure_text(Image.new("RGBA", (1, 1)), label, load_font(font_path, font_size))
+
+
+@lru_cache(maxsize=512)
+def render_text_layer(label, font_path, font_size, color):
+    """Rasterize a plain-text label once onto a transparent layer cropped to its size.
+
+    The layer is pre-filled with the text color at zero alpha so that
+    anti-aliased edges keep the right color when composited later.
+    """
+    font  = load_font(font_path, font_size)
+    w, h  = text_size(label, font_path, font_size)
+    layer = Image.new("RGBA", (max(w, 1), max(h, 1)), ImageColor.getrgb(color)[:3] + (0,))
+    draw  = ImageDraw.Draw(layer)
+    bbox  = draw.textbbox((0, 0), label, font=font)
+    draw.text((-bbox[0], -bbox[1]), label, font=font, fill=color)
+    return layer
+
+
+def paste_layer(img, layer, x, y):
+    # Blend in RGBA only within the layer's bounding box, clipped to the image
+    box = (max(x, 0), max(y, 0), min(x + layer.width, img.width), min(y + layer.height, img.height))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return
+    if (box[2] - box[0], box[3] - box[1]) != layer.size:
+        layer = layer.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y))
+    if HAS_NUMBA and not PILLOW_SIMD:
+        bg = np.array(img.crop(box))
+        alpha_over(bg, np.asarray(layer))
+        img.paste(Image.fromarray(bg), box)
+    elif HAS_NUMPY and not PILLOW_SIMD:
+        # RGBA over RGB as one vectorized expression, no RGBA round-trip
+        bg  = np.asarray(img.crop(box), dtype=np.uint16)
+        fg  = np.asarray(layer, dtype=np.uint16)
+        a   = fg[..., 3:4]
+        out = (fg[..., :3] * a + bg * (255 - a) + 127) // 255
+        img.paste(Image.fromarray(out.astype(np.uint8)), box)
+    else:
+        patch = Image.alpha_composite(img.crop(box).convert("RGBA"), layer)
+        img.paste(patch.convert("RGB"), box)
+
+
+def draw_text(img, label, font_path, font_size, color, position, ox, oy):
+    """Draw a label onto img; also returns the box of pixels that were touched."""
+    text_w, text_h = text_size(label, font_path, font_size)
     x, y = get_xy(position, img.width, img.height, text_w, text_h, ox, oy)
-    if HAS_PILMOJI:
-        with Pilmoji(img) as pj:
-            pj.text((x, y), label, font=font, fill=color)
+    box  = (x, y, x + text_w, y + text_h)
+    if HAS_PILMOJI and has_emoji(label):
+        # Pilmoji pastes emoji band by band, which only blends correctly onto
+        # opaque pixels, so draw straight onto the covered patch of the base.
+        # Its size is font.size tall, so leave room for descenders below it.
+        font  = load_font(font_path, font_size)
+        box   = (x, y, x + text_w, y + text_h + font.getmetrics()[1])
+        patch = img.crop(box)
+        with Pilmoji(patch, source=EMOJI_SOURCE) as pj:
+            pj.text((0, 0), label, font=font, fill=color)
+        img.paste(patch, box)
     else:
-        draw = ImageDraw.Draw(img)
-        bbox = draw.textbbox((0, 0), label, font=font)
-        draw.text((x - bbox[0], y - bbox[1]), label, font=font, fill=color)
-    return text_w, text_h, x, y
+        paste_layer(img, render_text_layer(label, font_path, font_size, color), x, y)
+    return text_w, text_h, x, y, box
 
 
-def draw_image_overlay(img, overlay_path, overlay_width, position, ox, oy):
-    overlay = Image.open(os.path.expanduser(overlay_path)).convert("RGBA")
-    new_h   = int(overlay.height * overlay_width / overlay.width)
-    overlay = overlay.resize((overlay_width, new_h), Image.LANCZOS)
-    x, y    = get_xy(position, img.width, img.height, overlay_width, new_h, ox, oy)
-    img.paste(overlay, (x, y), mask=overlay)
-    return overlay_width, new_h, x, y
+def load_overlay(overlay_path, overlay_width):
+    key = (overlay_path, overlay_width)
+    if key not in _overlay_cache:
+        overlay = Image.open(overlay_path).convert("RGBA")
+        new_h   = int(overlay.height * overlay_width / overlay.width)
+        _overlay_cache[key] = overlay.resize((overlay_width, new_h), Image.LANCZOS)
+    return _overlay_cache[key]
 
 
-def process_row(base, row_type, value, out_path, font, args):
-    img = base.copy().convert("RGBA")
+def draw_image_overlay(img, overlay_path, overlay_width, position, ox, oy):
+    overlay = load_overlay(os.path.expanduser(overlay_path), overlay_width)
+    x, y    = get_xy(position, img.width, img.height, overlay.width, overlay.height, ox, oy)
+    paste_layer(img, overlay, x, y)
+    return overlay.width, overlay.height, x, y, (x, y, x + overlay.width, y + overlay.height)
+
+
+def encode_image(img, out_path, output_format):
+    buf = BytesIO()
+    if out_path.suffix.lower() in (".jpg", ".jpeg"):
+        # Explicit 4:2:0, baseline, no Huffman optimization pass
+        img.save(buf, "JPEG", quality=92, subsampling=2, progressive=False, optimize=False)
+    elif output_format == "webp":
+        # Fastest WebP method; still well under JPEG size at similar quality
+        img.save(buf, "WEBP", quality=88, method=0)
+    else:
+        img.save(buf, Image.registered_extensions()[out_path.suffix.lower()], quality=92)
+    return buf.getvalue()
+
+
+def write_files(writes, failed):
+    # Runs in a thread in the main process so disk writes overlap compositing.
+    # Row results are printed here, once their file is actually on disk.
+    while True:
+        item = writes.get()
+        if item is None:
+            return
+        i, result, out_path, data = item
+        if data is not None:
+            try:
+                out_path.write_bytes(data)
+            except OSError as e:
+                result = f"ERROR: could not write {out_path}: {e}"
+        if result.startswith("ERROR"):
+            failed.append(i)
+        print(f"  [{i+1}] {result}")
+
 
+def check_row(row_type, value, out_path, font_path):
+    # Rows that would not produce a file, found before any work is scheduled
     if row_type == "text":
-        if not font:
+        if not font_path:
             return "SKIP: --font required for text rows"
-        w, h, x, y = draw_text(img, value, font, args.color, args.position, args.x, args.y)
-        info = f"text '{value}' at {x},{y} ({w}x{h}px)"
-
     elif row_type == "image":
         overlay_path = os.path.expanduser(value)
         if not os.path.exists(overlay_path):
             return f"SKIP: overlay not found: {overlay_path}"
-        w, h, x, y = draw_image_overlay(img, overlay_path, args.overlay_size, args.position, args.x, args.y)
-        info = f"image '{value}' at {x},{y} ({w}x{h}px)"
-
     else:
         return f"SKIP: unknown type '{row_type}' (use 'text' or 'image')"
+    if out_path.suffix.lower() not in Image.registered_extensions():
+        return f"SKIP: unsupported output format '{out_path.suffix}'"
+    return None
 
-    img.convert("RGB").save(str(out_path), quality=92)
-    return f"OK: {info} -> {out_path}"
+
+def process_row(task):
+    try:
+        return render_row(task)
+    except Exception as e:
+        # One bad input (corrupt image, failed emoji fetch) fails only its row
+        return None, f"ERROR: {type(e).__name__}: {e}"
+
+
+def render_row(task):
+    img_path, row_type, value, out_path, params = task
+    (font_path, font_size, color, position, ox, oy,
+     overlay_size, max_base_size, output_format) = params
+    img = load_canvas(img_path, max_base_size)
+
+    if row_type == "text":
+        w, h, x, y, box = draw_text(img, value, font_path, font_size, color, position, ox, oy)
+        info = f"text '{value}' at {x},{y} ({w}x{h}px)"
+    else:
+        w, h, x, y, box = draw_image_overlay(img, os.path.expanduser(value), overlay_size, position, ox, oy)
+        info = f"image '{value}' at {x},{y} ({w}x{h}px)"
+
+    try:
+        data = encode_image(img, out_path, output_format)
+    finally:
+        img.paste(load_base(img_path, max_base_size).crop(box), box)
+    return data, f"OK: {info} -> {out_path}"
+
+
+def positive_int(value):
+    n = int(value)
+    if n <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return n
 
 
 def main():
@@ -131,30 +366,42 @@ def main():
     p.add_argument("--x",            type=int, default=20,  help="Horizontal offset px (default: 20)")
     p.add_argument("--y",            type=int, default=20,  help="Vertical offset px (default: 20)")
     p.add_argument("--overlay-size", type=int, default=150, help="Image overlay width px (default: 150)")
+    p.add_argument("--output-format", default=None, choices=["jpeg", "webp"],
+                   help="Force output format and extension (default: from filename, else jpeg)")
+    p.add_argument("--max-base-size", type=positive_int, default=None,
+                   help="Shrink base images to fit N x N px before drawing (default: off)")
+    p.add_argument("--workers",      type=int, default=os.cpu_count(),
+                   help="Parallel worker processes (default: CPU count)")
     args = p.parse_args()
 
     print(f"{'✓' if HAS_PILMOJI else '⚠'} pilmoji {'enabled' if HAS_PILMOJI else 'not found — emoji will render as boxes'}")
+    print(f"{'✓' if PILLOW_SIMD else '⚠'} Pillow{'-SIMD' if PILLOW_SIMD else ''} {PIL.__version__} "
+          f"{'' if PILLOW_SIMD else '(stock build — pillow-simd not found) '}[{Image.core.__file__}]")
 
-    font = None
+    font_path = None
     if args.font:
         font_path = os.path.expanduser(args.font)
         if not os.path.exists(font_path):
             print(f"ERROR: Font not found: {font_path}"); return
-        font = ImageFont.truetype(font_path, args.font_size)
 
     out_dir = Path(args.output_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
+    out_ext = {"jpeg": ".jpg", "webp": ".webp"}.get(args.output_format)
 
     # Load base image for Mode 1
     base_image = None
+    image_path = None
     if args.image:
         image_path = os.path.expanduser(args.image)
         if not os.path.exists(image_path):
             print(f"ERROR: Base image not found: {image_path}"); return
         base_image = Image.open(image_path)
-        print(f"Mode 1 — single base image: {image_path} ({base_image.width}x{base_image.height}px)")
+        size = f"{base_image.width}x{base_image.height}px"
+        if args.max_base_size:
+            size += f", shrunk to fit {args.max_base_size}x{args.max_base_size}px"
+        print(f"Mode 1 — single base image: {image_path} ({size})")
 
-    with open(args.csv, newline="", encoding="utf-8") as f:
+    with open(args.csv, newline="", encoding="utf-8", buffering=1 << 20) as f:
         rows = [r for r in csv.reader(f) if r]
 
     # Auto-detect mode from first row
@@ -168,36 +415,91 @@ def main():
 
     print(f"Processing {len(rows)} rows...\n")
 
-    image_cache = {}
+    # Settings shared by every row, read off args once so workers get a plain
+    # tuple instead of the argparse Namespace
+    params = (font_path, args.font_size, args.color, args.position,
+              args.x, args.y, args.overlay_size, args.max_base_size, args.output_format)
+
+    # Build picklable tasks; rows rejected up front keep their place in the log
+    entries = []
+    found   = set()
 
     for i, row in enumerate(rows):
         if mode2:
             if len(row) < 3:
-                print(f"  [{i+1}] SKIP: not enough columns"); continue
+                entries.append((i, "SKIP: not enough columns")); continue
             img_path  = os.path.expanduser(row[0].strip())
             row_type  = row[1].strip().lower()
             value     = row[2].strip()
             out_name  = row[3].strip() if len(row) > 3 and row[3].strip() else f"image_{i+1:04d}.jpg"
 
-            if img_path not in image_cache:
+            if img_path not in found:
                 if not os.path.exists(img_path):
-                    print(f"  [{i+1}] SKIP: input image not found: {img_path}"); continue
-                image_cache[img_path] = Image.open(img_path)
-            base = image_cache[img_path]
+                    entries.append((i, f"SKIP: input image not found: {img_path}")); continue
+                found.add(img_path)
         else:
             row_type = row[0].strip().lower()
             value    = row[1].strip() if len(row) > 1 else ""
             out_name = row[2].strip() if len(row) > 2 and row[2].strip() else f"image_{i+1:04d}.jpg"
-            base     = base_image
+            img_path = image_path
 
-        if not Path(out_name).suffix:
+        if out_ext:
+            out_name = str(Path(out_name).with_suffix(out_ext))
+        elif not Path(out_name).suffix:
             out_name += ".jpg"
 
         out_path = out_dir / out_name
-        result   = process_row(base, row_type, value, out_path, font, args)
-        print(f"  [{i+1}] {result}")
-
-    print(f"\nDone. Output in '{out_dir}/'")
+        entries.append((i, check_row(row_type, value, out_path, font_path)
+                            or (img_path, row_type, value, out_path, params)))
+
+    # Rows sharing an output file would overwrite each other; as before the
+    # last CSV row wins, so only that one is rendered
+    last = {task[3]: i for i, task in entries if not isinstance(task, str)}
+    entries = [(i, task) if isinstance(task, str) or last[task[3]] == i
+               else (i, f"SKIP: overwritten by row {last[task[3]] + 1}")
+               for i, task in entries]
+
+    # Process rows grouped by (base image, type, value) so per-worker caches
+    # stay warm; rejected rows sort first. Logs keep the original row numbers.
+    entries.sort(key=lambda e: ("", "", "") if isinstance(e[1], str) else e[1][:3])
+
+    tasks = [t for _, t in entries if not isinstance(t, str)]
+
+    # Workers return encoded bytes; a writer thread puts them on disk. Only
+    # `window` rows are submitted at a time, so finished-but-unwritten images
+    # can't pile up in this process when the disk is slower than the workers.
+    writes  = queue.Queue(maxsize=4)
+    failed  = []
+    window  = 2 * (args.workers or 1)
+    todo    = iter(tasks)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        # Submit before starting the writer: with fork, the pool starts its
+        # workers on first submit, and they must not fork a threaded process
+        for task in islice(todo, window):
+            pending.append(ex.submit(process_row, task))
+        writer = threading.Thread(target=write_files, args=(writes, failed))
+        writer.start()
+        try:
+            for i, entry in entries:
+                if isinstance(entry, str):
+                    writes.put((i, entry, None, None))
+                    continue
+                data, result = pending.popleft().result()
+                for task in islice(todo, 1):
+                    pending.append(ex.submit(process_row, task))
+                writes.put((i, result, entry[3], data))
+        finally:
+            for future in pending:
+                future.cancel()
+            writes.put(None)
+            writer.join()
+
+    if failed:
+        print(f"\nDone with errors: {len(failed)} row(s) failed. Output in '{out_dir}/'")
+    else:
+        print(f"\nDone. Output in '{out_dir}/'")
 
 
 if __name__ == "__main__":